@@ -11,20 +11,24 @@ Key Features:
 - Game state management (who's playing, the board, etc.).
 
 Dependencies:
-- python-telegram-bot (v20.0 or higher)
+- python-telegram-bot (v20.0 or higher, with the [webhooks] extra)
 - python-chess (v1.9.0 or higher)
+- aiosqlite
+- cairosvg (optional, sends the board as an image instead of text)
 
 Before You Run:
 1.  Install the required libraries:
     ```bash
-    pip install python-telegram-bot python-chess
+    pip install "python-telegram-bot[webhooks]" python-chess aiosqlite cairosvg
     ```
 2.  Get your Telegram Bot Token from BotFather:
     -   Open Telegram and search for "BotFather".
     -   Follow the instructions to create a new bot.
     -   BotFather will provide you with a token (a long string of characters).
 3.  Replace 'YOUR_BOT_TOKEN' in the code below with your actual bot token.
-4.  Run the script.
+4.  Run the script.  To receive updates by webhook instead of polling,
+    set WEBHOOK_URL (and ideally WEBHOOK_SECRET) in the environment;
+    the bot listens on WEBHOOK_PORT (default 8443).
 
 How to Play:
 1.  Start a chat with the bot on Telegram.
@@ -40,27 +44,57 @@ Important Notes:
 -   This is a basic implementation and does not include all chess rules
     (e.g., castling, en passant).
 -   Error handling is basic.
--   The bot stores game data in a dictionary in memory, so games are
-    reset if the bot restarts.  For a production bot, you'd want to
-    use a database.
--   Make sure you handle exceptions, especially network errors from Telegram.
+-   The bot keeps game data in a dictionary in memory and writes it
+    through to a SQLite file (chess_bot.db), so games survive a restart.
+    Only the current position is stored, so repetitions from before a
+    restart are not counted.
+-   Games with no moves for 24 hours are abandoned and both players
+    are notified.
+-   Messages to Telegram are retried on flood control (429) and network
+    errors; other exceptions still need handling.
 """
 
+import asyncio
+import functools
 import logging
+import os
 from telegram import Update, ForceReply
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     ContextTypes,
     CommandHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
+import aiosqlite
 import chess
+import chess.svg
 import re
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional
+
+try:
+    import cairosvg  # Optional: renders boards as PNG photos.
+except (ImportError, OSError):  # OSError: the cairo system library is missing.
+    cairosvg = None
 
 # 1. Replace 'YOUR_BOT_TOKEN' with your actual bot token.
 BOT_TOKEN = ""  #  <---  PUT YOUR BOT TOKEN HERE!
 
+# Webhook settings.  Telegram pushes updates to WEBHOOK_URL as they happen;
+# leave it unset to fall back to long polling (handy for development).
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # Public base URL, e.g. https://chess.example.com
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")  # Telegram sends this back in every POST.
+WEBHOOK_CERT = os.environ.get("WEBHOOK_CERT")  # Only needed without a TLS-terminating proxy.
+WEBHOOK_KEY = os.environ.get("WEBHOOK_KEY")
+
 # 2. Enable logging (helps with debugging).  Good practice to include this.
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -68,23 +102,283 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 3. Store game state.  In a real application, use a database.
-games = {}  # Dictionary to store game information.
-#   - Key:  A unique game ID (e.g., a combination of user IDs).
+# 3. Store game state.  Games live in memory and are written through to
+#    SQLite so they survive a restart.
+DB_PATH = "chess_bot.db"
+db: Optional[aiosqlite.Connection] = None  # Opened in post_init.
+
+MAX_GAMES = 10000  # Least recently active games are dropped beyond this.
+GAME_TTL = 24 * 60 * 60  # Seconds without a move before a game is abandoned.
+SWEEP_INTERVAL = 5 * 60  # Seconds between checks for abandoned games.
+
+games: "OrderedDict[tuple[int, int], dict]" = OrderedDict()  # Dictionary to store game information.
+#   - Key:  A unique game ID (the sorted tuple of both user IDs).
 #   - Value: A dictionary containing:
 #       - 'board':  The chess.Board object.
 #       - 'players':  A tuple of Telegram user IDs (player1, player2).
 #       - 'turn': The Telegram user ID of the player whose turn it is.
-#       - 'start_time':  (Optional)  You could store the start time
+#       - 'last_activity_ts': Unix time of the last move (or of game creation).
+#       - 'lock': An asyncio.Lock held while a move is read and applied.
+#   Ordered from least to most recently active.
+
+user_to_game: dict[int, tuple[int, int]] = {}  # Index of Telegram user ID -> game ID, kept in sync with `games`.
+
+MAX_CACHED_USERNAMES = 100000
+username_to_id: "OrderedDict[str, int]" = OrderedDict()  # Lowercased username (no @) -> Telegram user ID, from incoming updates.
+id_to_username: dict[int, str] = {}  # Exact reverse of username_to_id, to forget old names on rename.
+
+MAX_CACHED_FILE_IDS = 10000
+fen_to_file_id: "OrderedDict[str, str]" = OrderedDict()  # Board FEN -> Telegram file_id of its uploaded image.
+_pending_uploads: dict[str, asyncio.Future] = {}  # Board FEN -> upload in progress.
+
+# Telegram usernames: 5-32 characters, letters, digits and underscores,
+# starting with a letter.
+_USERNAME_RE = re.compile(r'^@[A-Za-z][A-Za-z0-9_]{4,31}$')
 
 # 4. Helper Functions
 
-def get_game_id(user1_id: int, user2_id: int) -> str:
+def get_game_id(user1_id: int, user2_id: int) -> tuple[int, int]:
     """
     Generates a unique game ID from two user IDs.  The order
     of the IDs doesn't matter.
     """
-    return str(sorted((user1_id, user2_id)))
+    return (user1_id, user2_id) if user1_id < user2_id else (user2_id, user1_id)
+
+def _db_key(game_id: tuple[int, int]) -> str:
+    """
+    Converts a game ID into the text primary key used in the database.
+    """
+    return f"{game_id[0]}:{game_id[1]}"
+
+async def init_db(path: str) -> None:
+    """
+    Opens the games database, creating it if needed, and loads every
+    stored game back into memory.
+    """
+    global db
+    db = await aiosqlite.connect(path)
+    # WAL lets reads proceed during writes and avoids "database is locked".
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS games ("
+        "game_id TEXT PRIMARY KEY, fen TEXT, p1 INT, p2 INT, turn INT, updated_at INT)"
+    )
+    await db.commit()
+
+    async with db.execute(
+        "SELECT fen, p1, p2, turn, updated_at FROM games ORDER BY updated_at"
+    ) as cursor:
+        async for fen, p1, p2, turn, updated_at in cursor:
+            game_id = get_game_id(p1, p2)
+            games[game_id] = {
+                'board': chess.Board(fen),
+                'players': (p1, p2),
+                'turn': turn,
+                'last_activity_ts': updated_at,
+                'lock': asyncio.Lock(),
+            }
+            user_to_game[p1] = user_to_game[p2] = game_id
+    logger.info(f"Restored {len(games)} games from {path}")
+
+async def save_game(game_id: tuple[int, int]) -> None:
+    """
+    Writes a game's current position and turn through to the database.
+    Errors are logged, not raised, so the players still get their replies.
+    """
+    game = games[game_id]
+    player1_id, player2_id = game['players']
+    try:
+        await db.execute(
+            "INSERT OR REPLACE INTO games (game_id, fen, p1, p2, turn, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (_db_key(game_id), game['board'].fen(), player1_id, player2_id,
+             game['turn'], int(game['last_activity_ts'])),
+        )
+        await db.commit()
+    except aiosqlite.Error:
+        # The in-memory game is still correct; keep playing and let the
+        # next move's write catch the database up.
+        logger.exception(f"Could not save game {game_id}")
+
+async def end_game(game_id: tuple[int, int]) -> None:
+    """
+    Removes a finished game from memory, the lookup index and the database.
+    """
+    game = games.pop(game_id)
+    for player_id in game['players']:
+        del user_to_game[player_id]
+    try:
+        await db.execute("DELETE FROM games WHERE game_id = ?", (_db_key(game_id),))
+        await db.commit()
+    except aiosqlite.Error:
+        logger.exception(f"Could not delete game {game_id}")
+
+async def safe_send(coro_factory, retries: int = 3):
+    """
+    Awaits a Telegram API call, retrying it when it fails transiently.
+
+    Flood-control errors are retried after the delay Telegram asks for;
+    network errors are retried with exponential backoff.  Gives up after
+    `retries` retries and re-raises the last error.
+
+    The wait only holds up the calling handler: updates are processed
+    concurrently (see main), and callers must not hold a game lock
+    while sending.
+
+    Args:
+        coro_factory: A callable returning a fresh coroutine for each attempt,
+            e.g. lambda: context.bot.send_message(...).
+        retries: How many times to retry before giving up.
+
+    Returns:
+        Whatever the API call returns.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await coro_factory()
+        except RetryAfter as e:
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            error = e
+        except BadRequest:
+            raise  # Retrying a malformed request won't help.
+        except NetworkError as e:
+            delay = 2 ** attempt
+            error = e
+        if attempt == retries:
+            logger.error(f"Giving up on Telegram request after {retries} retries: {error}")
+            raise error
+        logger.warning(f"Telegram request failed ({error}), retrying in {delay}s")
+        await asyncio.sleep(delay)
+
+async def gather_sends(*sends) -> None:
+    """
+    Runs several sends concurrently.  A failed send is logged rather than
+    raised, so one player's failure never stops the other's message.
+    """
+    results = await asyncio.gather(*sends, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Failed to send a message: {result!r}", exc_info=result)
+
+def remember_username(user_id: int, username: Optional[str]) -> None:
+    """
+    Records a user's current username (or lack of one) in the username cache.
+    """
+    # Forget the user's previous name, and whoever held this name before.
+    old_username = id_to_username.pop(user_id, None)
+    if old_username is not None:
+        del username_to_id[old_username]
+    if not username:
+        return
+    username = username.lower()
+    previous_owner = username_to_id.pop(username, None)
+    if previous_owner is not None:
+        del id_to_username[previous_owner]
+
+    # Re-inserting puts the name at the end, marking it most recently seen.
+    username_to_id[username] = user_id
+    id_to_username[user_id] = username
+    if len(username_to_id) > MAX_CACHED_USERNAMES:
+        _, evicted_id = username_to_id.popitem(last=False)
+        del id_to_username[evicted_id]
+
+def _game_conflict(game_id: tuple[int, int], user1_id: int, user2_id: int,
+                   opponent_username: str) -> Optional[str]:
+    """
+    Checks whether a new game between two players can start.
+
+    Returns:
+        The reason it can't, or None if it can.
+    """
+    if game_id in games:
+        return "A game is already in progress with this user."
+    # Each player can only be in one game at a time.
+    if user1_id in user_to_game:
+        return "You are already in a game.  Finish it before starting a new one."
+    if user2_id in user_to_game:
+        return f"{opponent_username} is already in a game.  Finish it before starting a new one."
+    return None
+
+async def abandon_game(bot, game_id: tuple[int, int], reason: str,
+                       idle_since: Optional[float] = None) -> None:
+    """
+    Ends a game that is no longer being played and tells both players why.
+    If idle_since is given, the game is kept if it has had a move since then.
+    """
+    game = games.get(game_id)
+    if game is None:
+        return
+    # Take the game's lock so a move in progress finishes first.
+    async with game['lock']:
+        if games.get(game_id) is not game:
+            return  # Already ended while we waited.
+        if idle_since is not None and game['last_activity_ts'] > idle_since:
+            return  # A move came in while we waited.
+        await end_game(game_id)
+    logger.info(f"Abandoned game {game_id}: {reason}")
+    await gather_sends(
+        *(
+            safe_send(functools.partial(bot.send_message, chat_id=player_id, text=reason))
+            for player_id in game['players']
+        ),
+    )
+
+async def sweep_idle_games(bot) -> None:
+    """
+    Background task.  Periodically abandons games with no recent moves.
+    """
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        cutoff = time.time() - GAME_TTL
+        # `games` is ordered by activity, so the idle ones are at the front.
+        idle = []
+        for game_id, game in games.items():
+            if game['last_activity_ts'] > cutoff:
+                break
+            idle.append(game_id)
+        for game_id in idle:
+            # One failure must not end the task, or no game is swept again.
+            try:
+                await abandon_game(
+                    bot, game_id, "Your game was abandoned after 24 hours without a move.",
+                    idle_since=cutoff,
+                )
+            except Exception:
+                logger.exception(f"Could not abandon idle game {game_id}")
+
+# Unicode Chess Symbols
+PIECE_SYMBOLS = {
+    'P': '♟', 'R': '♜', 'N': '♞', 'B': '♝', 'Q': '♛', 'K': '♚',
+    'p': '♙', 'r': '♖', 'n': '♘', 'b': '♗', 'q': '♕', 'k': '♔',
+}
+_SYMBOL_TABLE = str.maketrans(PIECE_SYMBOLS)  # For str.translate; empty squares pass through.
+
+_EMPTY_RUN = re.compile(r'\d')  # A FEN digit: that many empty squares.
+
+# Board frame rows, built once at import time.
+TOP = "╔═══╤═══╤═══╤═══╤═══╤═══╤═══╤═══╗\n"
+SEP = "╠═══╪═══╪═══╪═══╪═══╪═══╪═══╪═══╣\n"
+BOT = "╚═══╧═══╧═══╧═══╧═══╧═══╧═══╧═══╝\n"
+FOOTER = "  a   b   c   d   e   f   g   h  \n"  # Letter labels
+
+@functools.lru_cache(maxsize=2048)
+def _render_fen(board_fen: str) -> str:
+    """
+    Renders the piece-placement part of a FEN string as a Unicode board.
+    Cached, so identical positions are only rendered once.
+    """
+    parts = [TOP]
+    for row, rank in enumerate(board_fen.split('/')):
+        rank = _EMPTY_RUN.sub(lambda m: ' ' * int(m.group()), rank).translate(_SYMBOL_TABLE)
+        parts.append(f"║ {' ║ '.join(rank)} ║\n")
+        if row < 7:
+            parts.append(SEP)
+    parts.append(BOT)
+    parts.append(FOOTER)
+    return "".join(parts)
 
 def display_board(board: chess.Board) -> str:
     """
@@ -97,47 +391,111 @@ def display_board(board: chess.Board) -> str:
     Returns:
         A string representation of the board.
     """
-    # Unicode Chess Symbols
-    piece_symbols = {
-        'P': '♟', 'R': '♜', 'N': '♞', 'B': '♝', 'Q': '♛', 'K': '♚',
-        'p': '♙', 'r': '♖', 'n': '♘', 'b': '♗', 'q': '♕', 'k': '♔',
-        '.': ' '  # Empty square
-    }
+    return _render_fen(board.board_fen())
 
-    board_str = "╔═══╤═══╤═══╤═══╤═══╤═══╤═══╤═══╗\n"
-    for row in range(8):
-        board_str += "║"
-        for col in range(8):
-            square = chess.square(col, 7 - row)  # chess.square(col, row)
-            piece = board.piece_at(square)
-            if piece:
-                symbol = piece_symbols[piece.symbol()]
-            else:
-                symbol = ' '
-            board_str += f" {symbol} ║"
-        board_str += "\n"
-        if row < 7:
-            board_str += "╠═══╪═══╪═══╪═══╪═══╪═══╪═══╪═══╣\n"
-    board_str += "╚═══╧═══╧═══╧═══╧═══╧═══╧═══╧═══╝\n"
-    board_str += "  a   b   c   d   e   f   g   h  \n"  # Add letter labels
-    return board_str
+def _render_png(board_fen: str) -> bytes:
+    """
+    Renders the piece-placement part of a FEN string as a PNG image.
+    """
+    svg = chess.svg.board(chess.BaseBoard(board_fen))
+    return cairosvg.svg2png(bytestring=svg.encode())
+
+async def _send_text_board(bot, chat_id: int, board: chess.Board, caption: Optional[str]) -> None:
+    """
+    Sends the board as a Unicode text message, below the caption if any.
+    """
+    text = display_board(board)
+    await safe_send(lambda: bot.send_message(chat_id=chat_id, text=f"{caption}\n{text}" if caption else text))
+
+async def send_board(bot, chat_id: int, board: chess.Board, caption: Optional[str] = None) -> None:
+    """
+    Sends the board to a chat as a photo, with an optional caption.
+
+    Each position is uploaded once; later sends of the same position
+    reuse the file_id Telegram returned for it.  Falls back to the
+    Unicode text board if cairosvg is not installed.
+    """
+    if cairosvg is None:
+        await _send_text_board(bot, chat_id, board, caption)
+        return
+
+    key = board.board_fen()
+    file_id = fen_to_file_id.get(key)
+    if file_id is not None:
+        fen_to_file_id.move_to_end(key)  # Mark as most recently used.
+    if file_id is None and key in _pending_uploads:
+        # Another chat is uploading this position right now; wait for it.
+        file_id = await _pending_uploads[key]
+        if file_id is None:
+            await _send_text_board(bot, chat_id, board, caption)
+            return
+    if file_id is not None:
+        try:
+            await safe_send(lambda: bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption))
+        except Exception as e:
+            # The file_id may no longer be valid; forget it so the next
+            # send of this position uploads a fresh image.
+            logger.error(f"Could not send cached board image, sending text instead: {e!r}")
+            if fen_to_file_id.get(key) == file_id:
+                del fen_to_file_id[key]
+            await _send_text_board(bot, chat_id, board, caption)
+        return
+
+    upload = _pending_uploads[key] = asyncio.get_running_loop().create_future()
+    try:
+        png = await asyncio.to_thread(_render_png, key)
+        message = await safe_send(lambda: bot.send_photo(chat_id=chat_id, photo=png, caption=caption))
+        file_id = message.photo[-1].file_id
+    except Exception as e:
+        logger.error(f"Could not send board image, sending text instead: {e!r}")
+    else:
+        fen_to_file_id[key] = file_id
+        if len(fen_to_file_id) > MAX_CACHED_FILE_IDS:
+            fen_to_file_id.popitem(last=False)
+    finally:
+        # Always resolve the future, even if cancelled, so waiters never hang.
+        # None tells them to fall back to sending text.
+        upload.set_result(file_id)
+        del _pending_uploads[key]
+
+    if file_id is None:
+        await _send_text_board(bot, chat_id, board, caption)
+
+# Game-over announcements, keyed by how the game ended.
+GAME_OVER_MESSAGES = {
+    chess.Termination.CHECKMATE: "Checkmate!",
+    chess.Termination.STALEMATE: "Stalemate!",
+    chess.Termination.INSUFFICIENT_MATERIAL: "Insufficient Material!",
+    chess.Termination.SEVENTYFIVE_MOVES: "75-move rule!",
+    chess.Termination.FIVEFOLD_REPETITION: "Fivefold repetition!",
+    chess.Termination.THREEFOLD_REPETITION: "Threefold repetition!",
+}
 
 # 5. Command Handlers
 
+async def index_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Runs before every other handler.  Remembers the sender's username so
+    /newgame can find them without asking Telegram.
+    """
+    user = update.effective_user
+    if user:
+        remember_username(user.id, user.username)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handles the /start command.  Introduces the bot and explains how to
     start a new game.
     """
     user = update.effective_user
-    await context.bot.send_message(
+    await safe_send(lambda: context.bot.send_message(
         chat_id=update.effective_chat.id,
         text=f"Hello {user.first_name}!\n\n"
         "Welcome to the Chess Bot!\n"
         "To start a new game, use /newgame @opponent_username\n"
         "For example: /newgame @ChessPlayer2\n",
         reply_markup=ForceReply(selective=True),
-    )
+    ))
 
 async def newgame(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -148,54 +506,70 @@ async def newgame(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     user1 = update.effective_user
     if not context.args:
-        await context.bot.send_message(
+        await safe_send(lambda: context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="Please specify an opponent's username (e.g., /newgame @ChessPlayer2).",
             reply_to_message_id=update.message.message_id,
-        )
+        ))
         return
 
     opponent_username = context.args[0]
-    if not opponent_username.startswith("@"):
-        await context.bot.send_message(
+    if not _USERNAME_RE.match(opponent_username):
+        await safe_send(lambda: context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="Invalid username format.  Please use @username.",
             reply_to_message_id=update.message.message_id,
-        )
+        ))
         return
 
     # Get the opponent's user ID.  This is crucial for identifying the players.
+    #  Anyone who has messaged the bot is already known; only ask Telegram
+    #  about users we haven't seen.
+    user2_id = username_to_id.get(opponent_username[1:].lower())
     try:
-        opponent = await context.bot.get_chat(username=opponent_username)
-        user2_id = opponent.id
+        if user2_id is None:
+            opponent = await context.bot.get_chat(chat_id=opponent_username)
+            user2_id = opponent.id
+            remember_username(user2_id, opponent.username)
     except Exception as e:
         logger.error(f"Error getting opponent's user ID: {e}")
-        await context.bot.send_message(
+        await safe_send(lambda: context.bot.send_message(
             chat_id=update.effective_chat.id,
             text=f"Error: Could not find user {opponent_username}.  "
                  f"Please make sure the username is correct and the user has"
                  f" started the bot.",
             reply_to_message_id=update.message.message_id,
-        )
+        ))
         return
 
     user1_id = user1.id
     if user1_id == user2_id:
-        await context.bot.send_message(
+        await safe_send(lambda: context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="You cannot start a game with yourself!",
             reply_to_message_id=update.message.message_id,
-        )
+        ))
         return
 
     game_id = get_game_id(user1_id, user2_id)  # Generate unique game ID.
 
-    if game_id in games:
-        await context.bot.send_message(
+    # Make room by dropping the least recently active game.  Updates are
+    # handled concurrently, so another /newgame may claim one of the players
+    # while we evict; re-check after every await.  Nothing below awaits
+    # before the game is registered, so the last check is final.
+    conflict = _game_conflict(game_id, user1_id, user2_id, opponent_username)
+    while conflict is None and len(games) >= MAX_GAMES:
+        await abandon_game(
+            context.bot, next(iter(games)),
+            "Your game was abandoned because the bot has too many active games.",
+        )
+        conflict = _game_conflict(game_id, user1_id, user2_id, opponent_username)
+    if conflict is not None:
+        await safe_send(lambda: context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text="A game is already in progress with this user.",
+            text=conflict,
             reply_to_message_id=update.message.message_id,
-        )
+        ))
         return
 
     # Initialize a new game.
@@ -208,28 +582,30 @@ async def newgame(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         'board': board,
         'players': players,
         'turn': turn,
+        'last_activity_ts': time.time(),
+        'lock': asyncio.Lock(),
     }
+    user_to_game[user1_id] = user_to_game[user2_id] = game_id
+    await save_game(game_id)
 
     # Send messages to both players to notify them that the game has started.
-    await context.bot.send_message(
-        chat_id=user1_id,
-        text=f"New game started with {opponent_username}!\n"
-             f"You are White.  Your move.",
-    )
-    await context.bot.send_message(
-        chat_id=user2_id,
-        text=f"New game started with {user1.username}!\n"
-             f"You are Black.  Waiting for White to move.",
+    await gather_sends(
+        safe_send(lambda: context.bot.send_message(
+            chat_id=user1_id,
+            text=f"New game started with {opponent_username}!\n"
+                 f"You are White.  Your move.",
+        )),
+        safe_send(lambda: context.bot.send_message(
+            chat_id=user2_id,
+            text=f"New game started with {user1.username}!\n"
+                 f"You are Black.  Waiting for White to move.",
+        )),
     )
 
     # Display the initial board.
-    await context.bot.send_message(
-        chat_id=user1_id,
-        text=display_board(board),
-    )
-    await context.bot.send_message(
-        chat_id=user2_id,
-        text=display_board(board),
+    await gather_sends(
+        send_board(context.bot, user1_id, board),
+        send_board(context.bot, user2_id, board),
     )
     #  Potentially add a message to the group
 
@@ -244,150 +620,179 @@ async def handle_move(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     move_text = update.message.text
 
     # Try to find the game.
-    game_id = None
-    for g_id, game_data in games.items():
-        if user.id in game_data['players']:
-            game_id = g_id
-            break
+    game_id = user_to_game.get(user.id)
     if game_id is None:
-        await context.bot.send_message(
+        await safe_send(lambda: context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="You are not currently in a game.  Use /newgame @opponent_username to start one.",
             reply_to_message_id=update.message.message_id,
-        )
+        ))
         return
 
     game = games[game_id]
-    board = game['board']
-    player1_id, player2_id = game['players']
-    turn = game['turn']
-
-    if user.id != turn:
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="It is not your turn to move.",
-            reply_to_message_id=update.message.message_id,
-        )
-        return
 
-    # 6.  Parse and Validate the move.
-    try:
-        move = board.parse_san(move_text)  #  Use algebraic notation
-    except ValueError:
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="Invalid move format.  Please use algebraic notation (e.g., e2e4, Nf3, Rd8).",
-            reply_to_message_id=update.message.message_id,
-        )
-        return
+    # Moves in one game are serialized by its lock so two messages can't
+    # both read the same board and push onto it.  The lock covers reading
+    # and updating the game state only; replies are sent after releasing
+    # it, from a snapshot of the position, so network I/O never holds it.
+    # Updates are processed concurrently (see main), so other games proceed
+    # in parallel.
+    error_text = None
+    outcome = None
+    async with game['lock']:
+        if games.get(game_id) is not game:
+            return  # The game ended while we were waiting for the lock.
+        board = game['board']
+        player1_id, player2_id = game['players']
+        turn = game['turn']
+
+        if user.id != turn:
+            error_text = "It is not your turn to move."
+        else:
+            # 6.  Parse and Validate the move.  Most players type UCI (e.g., e2e4),
+            #     which is much cheaper to parse, so try that before SAN.
+            move_text = move_text.strip()
+            try:
+                move = chess.Move.from_uci(move_text)
+                if not board.is_legal(move):
+                    raise ValueError(move_text)
+            except ValueError:
+                try:
+                    move = board.parse_san(move_text)  #  Use algebraic notation
+                    # parse_san accepts null moves ("--", "0000") without
+                    # checking them, so re-check legality here.
+                    if not board.is_legal(move):
+                        raise ValueError(move_text)
+                except ValueError:
+                    error_text = ("Invalid or illegal move.  "
+                                  "Please use algebraic notation (e.g., e2e4, Nf3, Rd8).")
+
+        if error_text is None:
+            # 7. Make the move and update the game state.
+            board.push(move)  # Make the move on the board.
+            # Only real moves count as activity, so an idle game can't be
+            # kept alive by invalid or out-of-turn messages.
+            games.move_to_end(game_id)  # Mark as most recently active.
+            game['last_activity_ts'] = time.time()
+
+            # Switch the turn to the other player.
+            game['turn'] = player2_id if turn == player1_id else player1_id
+            position = board.copy(stack=False)
+
+            # 8. Check for game over (checkmate, stalemate, etc.).  outcome() covers
+            #    every automatic ending in one pass; threefold repetition is only a
+            #    claimable draw, so it is checked separately.
+            outcome = board.outcome()
+            if outcome is None and board.is_repetition():
+                outcome = chess.Outcome(chess.Termination.THREEFOLD_REPETITION, None)
+            if outcome is not None:
+                await end_game(game_id)  # Remove the game from the dictionary.
+            else:
+                await save_game(game_id)
 
-    if not board.is_legal(move):
-        await context.bot.send_message(
+    if error_text is not None:
+        await safe_send(lambda: context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text="Illegal move.",
+            text=error_text,
             reply_to_message_id=update.message.message_id,
-        )
+        ))
         return
 
-    # 7. Make the move and update the game state.
-    board.push(move)  # Make the move on the board.
-
-    # Switch the turn to the other player.
-    game['turn'] = player2_id if turn == player1_id else player1_id
-
-    # 8. Check for game over (checkmate, stalemate, etc.).
-    if board.is_checkmate():
-        winner = user.id
-        loser = player2_id if winner == player1_id else player1_id
-        await context.bot.send_message(
-            chat_id=player1_id,
-            text=f"Checkmate!  You win!\n{display_board(board)}",
-        )
-        await context.bot.send_message(
-            chat_id=player2_id,
-            text=f"Checkmate!  You lose.\n{display_board(board)}",
+    next_player_id = player2_id if turn == player1_id else player1_id
+
+    if outcome is not None:
+        headline = GAME_OVER_MESSAGES[outcome.termination]
+        if outcome.winner is None:
+            mover_text = opponent_text = headline
+        else:
+            # Only the player who just moved can have delivered checkmate.
+            mover_text = f"{headline}  You win!"
+            opponent_text = f"{headline}  You lose."
+        await gather_sends(
+            send_board(context.bot, user.id, position, mover_text),
+            send_board(context.bot, next_player_id, position, opponent_text),
         )
-        del games[game_id]  # Remove the game from the dictionary.
-        return
-    elif board.is_stalemate():
-        await context.bot.send_message(
-            chat_id=player1_id,
-            text=f"Stalemate!\n{display_board(board)}",
-        )
-        await context.bot.send_message(
-            chat_id=player2_id,
-            text=f"Stalemate!\n{display_board(board)}",
-        )
-        del games[game_id]
-        return
-    elif board.is_insufficient_material(): #added other end game conditions
-        await context.bot.send_message(
-            chat_id=player1_id,
-            text=f"Insufficient Material!\n{display_board(board)}",
-        )
-        await context.bot.send_message(
-            chat_id=player2_id,
-            text=f"Insufficient Material!\n{display_board(board)}",
-        )
-        del games[game_id]
-        return
-    elif board.is_seventyfive_moves():
-        await context.bot.send_message(
-            chat_id=player1_id,
-            text=f"75-move rule!\n{display_board(board)}",
-        )
-        await context.bot.send_message(
-            chat_id=player2_id,
-            text=f"75-move rule!\n{display_board(board)}",
-        )
-        del games[game_id]
-        return
-    elif board.is_repetition():
-        await context.bot.send_message(
-            chat_id=player1_id,
-            text=f"Threefold repetition!\n{display_board(board)}",
-        )
-        await context.bot.send_message(
-            chat_id=player2_id,
-            text=f"Threefold repetition!\n{display_board(board)}",
-        )
-        del games[game_id]
         return
 
     # 9. Send the updated board to both players.
-    await context.bot.send_message(
-        chat_id=player1_id,
-        text=f"Board after your move:\n{display_board(board)}",
-    )
-    await context.bot.send_message(
-        chat_id=player2_id,
-        text=f"Board after opponent's move:\n{display_board(board)}",
+    await gather_sends(
+        send_board(context.bot, user.id, position, "Board after your move:"),
+        send_board(context.bot, next_player_id, position, "Board after opponent's move:"),
     )
 
     # 10.  Tell the next player it's their turn.
-    next_player_id = game['turn']
-    await context.bot.send_message(
+    await safe_send(lambda: context.bot.send_message(
         chat_id=next_player_id,
         text="It's your turn to move.",
         # reply_to_message_id=update.message.message_id, # Removed this
-    )
+    ))
+
+async def post_init(application: Application) -> None:
+    """
+    Loads saved games and starts background tasks once the bot is initialized.
+    """
+    await init_db(DB_PATH)
+    application.bot_data['sweeper'] = asyncio.create_task(sweep_idle_games(application.bot))
+
+async def post_shutdown(application: Application) -> None:
+    """
+    Stops the background tasks and closes the database opened in post_init.
+    """
+    application.bot_data['sweeper'].cancel()
+    await db.close()
 
 def main() -> None:
     """
     Main function.  Sets up the bot and starts the Telegram event loop.
     """
-    # 11. Create the Application and pass it your bot's token.
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    # 11. Create the Application and pass it your bot's token.  Outgoing
+    #     messages get a large connection pool so gathered sends don't queue;
+    #     getUpdates only needs a few connections but a long read timeout to
+    #     cover the long-polling window.
+    request = HTTPXRequest(
+        connection_pool_size=256,
+        pool_timeout=30,
+        connect_timeout=10,
+        read_timeout=35,
+    )
+    get_updates_request = HTTPXRequest(connection_pool_size=8, read_timeout=35)
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(True)  # Per-game locks keep each game consistent.
+        .build()
+    )
 
-    # 12. Register command handlers.
+    # 12. Register command handlers.  index_user sits in an earlier group so
+    #     it sees every update and the handlers below still run.
+    application.add_handler(TypeHandler(Update, index_user), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("newgame", newgame))
 
     # 13. Register a message handler to handle moves (and any other text).
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_move))
 
-    # 14. Start the bot.
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # 14. Start the bot.  With a webhook, Telegram delivers each update as
+    #     soon as it arrives; run_webhook registers the URL with setWebhook.
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=WEBHOOK_PORT,
+            url_path=BOT_TOKEN,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{BOT_TOKEN}",
+            secret_token=WEBHOOK_SECRET,
+            cert=WEBHOOK_CERT,
+            key=WEBHOOK_KEY,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        # Long polling: each getUpdates call waits up to 30 seconds for new
+        # updates instead of returning empty right away.
+        application.run_polling(timeout=30, allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()